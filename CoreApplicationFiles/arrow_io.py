@@ -0,0 +1,24 @@
+# arrow_io.py
+"""
+Arrow-backed CSV helpers shared by the indexing scripts (step1 cleaning, step2 Qdrant upload).
+"""
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+
+def read_csv_arrow(path: str) -> pd.DataFrame:
+    """Read a CSV with the multithreaded Arrow reader; text columns stay string[pyarrow]."""
+    table = pacsv.read_csv(
+        path,
+        read_options=pacsv.ReadOptions(use_threads=True, block_size=64 << 20),
+        # free-text fields may hold quoted line breaks; without this a block boundary can split a row
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),
+        convert_options=pacsv.ConvertOptions(strings_can_be_null=True),
+    )
+    return table.to_pandas(types_mapper={pa.string(): pd.ArrowDtype(pa.string())}.get)
+
+
+def write_csv_arrow(df: pd.DataFrame, path: str) -> None:
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), path)
@@ -2,15 +2,23 @@
 """
 Build cleaned datasets and a TF-IDF knowledge base for the Network Troubleshooter.
 Improvements:
- - Drop duplicates, fillna, utf-8 normalize, whitespace cleaning
+ - Drop duplicates, fillna, control-character and whitespace cleaning
  - Save cleaned CSVs to data/cleaned_*.csv
- - Build TF-IDF index and save models/network_index.pkl
+ - Build TF-IDF index and save it to models/ (tfidf.npz, vectorizer.joblib, records.parquet)
 """
 
+import numpy as np
 import pandas as pd
 import os
-import pickle
-from sklearn.feature_extraction.text import TfidfVectorizer
+import re
+import joblib
+import scipy.sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.pipeline import Pipeline
+from arrow_io import read_csv_arrow, write_csv_arrow
+
+# Above this many records, hash tokens in one pass instead of growing a vocabulary dict
+HASHING_MIN_RECORDS = 1_000_000
 
 DATA_PATH = "data"
 CLEAN_PATH = os.path.join(DATA_PATH, "cleaned")
@@ -26,113 +34,124 @@ for p in [src_tech_path, src_incident_path, meta_tech_path, meta_incident_path]:
     if not os.path.exists(p):
         raise FileNotFoundError(f"Missing required file: {p}")
 
+# Plain pattern strings: Arrow string columns run them in pyarrow's RE2 (compiled re.Pattern
+# objects would force a cast back to Python strings). Tab/newline/CR are left for the whitespace pass
+_CTRL_PATTERN = r"[\x00-\x08\x0b\x0c\x0e-\x1f]"
+_WS_PATTERN = r"\s+"
+
 def basic_clean(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df.drop_duplicates(inplace=True)
-    df.fillna("", inplace=True)
+    df = df.fillna("")
     # normalize text columns
-    for col in df.select_dtypes(include=["object"]).columns:
-        # ensure string, remove control characters, normalize whitespace
+    for col in df.select_dtypes(include=["object", "string"]).columns:
+        # remove control characters, normalize whitespace; string[pyarrow] columns stay in Arrow
+        # (CSV readers already decode UTF-8, so no encode/decode round-trip is needed)
         df[col] = (
             df[col]
-            .astype(str)
-            .apply(lambda s: s.encode("utf-8", "ignore").decode("utf-8", errors="ignore"))
-            .str.replace(r"\s+", " ", regex=True)
+            .str.replace(_CTRL_PATTERN, "", regex=True)
+            .str.replace(_WS_PATTERN, " ", regex=True)
             .str.strip()
         )
-    return df
+    # dedupe on a 64-bit fingerprint of the normalized row: one hash-table pass over ints
+    # instead of comparing every column, and rows differing only in whitespace collapse
+    return df[~pd.util.hash_pandas_object(df, index=False).duplicated()]
 
 print("🔄 Loading CSVs...")
-src_tech = basic_clean(pd.read_csv(src_tech_path))
-src_incident = basic_clean(pd.read_csv(src_incident_path))
-meta_tech = basic_clean(pd.read_csv(meta_tech_path))
-meta_incident = basic_clean(pd.read_csv(meta_incident_path))
+src_tech = basic_clean(read_csv_arrow(src_tech_path))
+src_incident = basic_clean(read_csv_arrow(src_incident_path))
+meta_tech = basic_clean(read_csv_arrow(meta_tech_path))
+meta_incident = basic_clean(read_csv_arrow(meta_incident_path))
 
 # Save cleaned copies for traceability
-src_tech.to_csv(os.path.join(CLEAN_PATH, "cleaned_src_tech_records.csv"), index=False)
-src_incident.to_csv(os.path.join(CLEAN_PATH, "cleaned_src_incident_records.csv"), index=False)
-meta_tech.to_csv(os.path.join(CLEAN_PATH, "cleaned_metadata_tech_records.csv"), index=False)
-meta_incident.to_csv(os.path.join(CLEAN_PATH, "cleaned_metadata_incident_records.csv"), index=False)
+write_csv_arrow(src_tech, os.path.join(CLEAN_PATH, "cleaned_src_tech_records.csv"))
+write_csv_arrow(src_incident, os.path.join(CLEAN_PATH, "cleaned_src_incident_records.csv"))
+write_csv_arrow(meta_tech, os.path.join(CLEAN_PATH, "cleaned_metadata_tech_records.csv"))
+write_csv_arrow(meta_incident, os.path.join(CLEAN_PATH, "cleaned_metadata_incident_records.csv"))
 print("✅ Cleaned CSVs saved to", CLEAN_PATH)
 
 # Compose combined records for TF-IDF indexing and optional QA tests
-records = []
-def segment_text(text, max_len=1000):
-    # naive segmentation: split text into chunks if longer than max_len chars
-    text = text or ""
-    if len(text) <= max_len:
-        return [text]
-    chunks = []
-    i = 0
-    while i < len(text):
-        chunks.append(text[i:i+max_len])
-        i += max_len
-    return chunks
+SEGMENT_MAX_LEN = 1000
+
+def text_col(df: pd.DataFrame, *names: str) -> pd.Series:
+    # first matching column as stripped text, or empty strings if none exist
+    for name in names:
+        if name in df.columns:
+            return df[name].astype(str).str.strip()
+    return pd.Series("", index=df.index, dtype=object)
+
+def segment_series(s: pd.Series, max_len: int = SEGMENT_MAX_LEN) -> pd.Series:
+    # naive segmentation: split each text into chunks of at most max_len chars.
+    # Empty texts are dropped; the index of the source row is kept on every chunk.
+    s = s[s != ""]
+    return s.str.findall(rf".{{1,{max_len}}}", flags=re.S).explode()
+
+def metadata_records(df: pd.DataFrame, source: str, solution_col: str, tags_col: str) -> pd.DataFrame:
+    product = text_col(df, "ProductInformation")
+    solution = text_col(df, solution_col)
+    tags = text_col(df, tags_col)
+    # one record per segment of the combined text; only the segment count is needed,
+    # so derive it from the length instead of materializing the chunks
+    combined_len = (
+        len("Product Info: \nSolution: \nTags: ")
+        + product.str.len() + solution.str.len() + tags.str.len()
+    )
+    idx = df.index.repeat(-(-combined_len // SEGMENT_MAX_LEN))
+    return pd.DataFrame({
+        "source": source,
+        "problem": product.loc[idx].to_numpy(),
+        "solution": solution.loc[idx].to_numpy(),
+        "tags": tags.loc[idx].to_numpy()
+    })
 
 # src_incident: use ProblemDescription if present
-for _, row in src_incident.iterrows():
-    problem = str(row.get("ProblemDescription", "")).strip()
-    if not problem:
-        continue
-    for seg in segment_text(problem):
-        records.append({
-            "source": "Incident Ticket",
-            "problem": seg,
-            "solution": "",
-            "tags": row.get("Tags", "")
-        })
+incident_problem = segment_series(text_col(src_incident, "ProblemDescription"))
+incident_records = pd.DataFrame({
+    "source": "Incident Ticket",
+    "problem": incident_problem.to_numpy(),
+    "solution": "",
+    "tags": text_col(src_incident, "Tags").loc[incident_problem.index].to_numpy()
+})
 
 # src_tech: step_description or StepDescription
-for _, row in src_tech.iterrows():
-    step_desc = str(row.get("step_description", row.get("StepDescription", ""))).strip()
-    if not step_desc:
-        continue
-    for seg in segment_text(step_desc):
-        records.append({
-            "source": "Technical Steps",
-            "problem": "",
-            "solution": seg,
-            "tags": row.get("TechnicalTags", "")
-        })
-
-# metadata tech
-for _, row in meta_tech.iterrows():
-    product = str(row.get("ProductInformation", "")).strip()
-    solution = str(row.get("SolutionSteps", "")).strip()
-    tags = str(row.get("TechnicalTags", "")).strip()
-    combined = f"Product Info: {product}\nSolution: {solution}\nTags: {tags}"
-    for seg in segment_text(combined):
-        records.append({
-            "source": "Tech Metadata",
-            "problem": product,
-            "solution": solution,
-            "tags": tags
-        })
-
-# metadata incident
-for _, row in meta_incident.iterrows():
-    product = str(row.get("ProductInformation", "")).strip()
-    solution = str(row.get("SolutionDetails", "")).strip()
-    tags = str(row.get("Tags", "")).strip()
-    combined = f"Product Info: {product}\nSolution: {solution}\nTags: {tags}"
-    for seg in segment_text(combined):
-        records.append({
-            "source": "Incident Metadata",
-            "problem": product,
-            "solution": solution,
-            "tags": tags
-        })
-
-df = pd.DataFrame(records)
+tech_solution = segment_series(text_col(src_tech, "step_description", "StepDescription"))
+tech_records = pd.DataFrame({
+    "source": "Technical Steps",
+    "problem": "",
+    "solution": tech_solution.to_numpy(),
+    "tags": text_col(src_tech, "TechnicalTags").loc[tech_solution.index].to_numpy()
+})
+
+df = pd.concat([
+    incident_records,
+    tech_records,
+    metadata_records(meta_tech, "Tech Metadata", "SolutionSteps", "TechnicalTags"),
+    metadata_records(meta_incident, "Incident Metadata", "SolutionDetails", "Tags"),
+], ignore_index=True)
 print(f"✅ Prepared {len(df)} combined records for indexing.")
 
 # Build TF-IDF (keeps for local diagnostics / fallback)
-vectorizer = TfidfVectorizer(stop_words="english", max_features=5000, max_df=0.85, min_df=1)
-X = vectorizer.fit_transform((df["problem"].fillna("") + " " + df["solution"].fillna("") + " " + df["tags"].fillna("")).values.astype(str))
-
-with open("models/network_index.pkl", "wb") as f:
-    pickle.dump({"tfidf": X, "vectorizer": vectorizer, "data": df}, f)
-
-print("✅ TF-IDF index saved to models/network_index.pkl")
+TEXT_COLS = ["problem", "solution", "tags"]
+df[TEXT_COLS] = df[TEXT_COLS].fillna("")
+
+def iter_docs(df: pd.DataFrame):
+    # stream "problem solution tags" documents instead of materializing concatenated columns
+    for problem, solution, tags in zip(*(df[c].to_numpy() for c in TEXT_COLS)):
+        yield f"{problem} {solution} {tags}"
+
+# float32 halves the sparse matrix and the cost of similarity products against it
+if len(df) >= HASHING_MIN_RECORDS:
+    vectorizer = Pipeline([
+        ("hv", HashingVectorizer(stop_words="english", n_features=1 << 18, alternate_sign=False, norm=None, dtype=np.float32)),
+        ("tfidf", TfidfTransformer()),
+    ])
+else:
+    vectorizer = TfidfVectorizer(stop_words="english", max_features=5000, max_df=0.85, min_df=1, dtype=np.float32)
+X = vectorizer.fit_transform(iter_docs(df))
+
+# CSR matrix in scipy's native format, compressed vectorizer, columnar records
+scipy.sparse.save_npz("models/tfidf.npz", X.tocsr())
+joblib.dump(vectorizer, "models/vectorizer.joblib", compress=3)
+df.to_parquet("models/records.parquet", compression="zstd", index=False)
+
+print("✅ TF-IDF index saved to models/ (tfidf.npz, vectorizer.joblib, records.parquet)")
 print("\nSample records:")
 print(df.sample(min(5, len(df)))[["source", "problem", "solution"]])
@@ -8,15 +8,28 @@ Env vars:
 """
 
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 from dotenv import load_dotenv
 load_dotenv()
 
 import pandas as pd
 import numpy as np
+import torch
+
+# Column assignments on frames derived from others must not silently copy them
+pd.options.mode.copy_on_write = True
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from sentence_transformers import SentenceTransformer
+from arrow_io import read_csv_arrow
+
+try:
+    import numba
+except ImportError:  # optional: offline search falls back to NumPy
+    numba = None
 
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
@@ -26,11 +39,40 @@ if not QDRANT_URL or not QDRANT_API_KEY:
     print("⚠️ Qdrant credentials not found in environment. Set QDRANT_URL and QDRANT_API_KEY.")
     client = None
 else:
-    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
+    # gRPC avoids JSON-encoding every vector on upload and search
+    client = QdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, prefer_grpc=True, timeout=60)
 
 print("🧠 Loading SentenceTransformer model...")
 model = SentenceTransformer("all-MiniLM-L6-v2")
+if torch.cuda.is_available():
+    # FP16 halves activation memory and runs on Tensor Cores
+    model.half()
 VECTOR_SIZE = model.get_sentence_embedding_dimension()
+# FP16 on GPU fits larger encode batches; CPU stays at 128 to limit padding
+EMBED_BATCH_SIZE = 256 if torch.cuda.is_available() else 128
+UPSERT_BATCH_SIZE = 256
+# Records encoded per step of the encode/upload pipeline
+INDEX_CHUNK_SIZE = 4096
+# Denser HNSW graph: quantized vectors keep the larger link lists affordable
+HNSW_M = 32
+HNSW_EF_CONSTRUCT = 256
+# Full-precision vectors live on disk (only read to rescore); the int8 copy stays in RAM
+VECTORS_ON_DISK = True
+# Query-time HNSW beam width and quantized-search rescoring
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=64,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+# Wider beam for requests that need more than a handful of neighbours
+SEARCH_PARAMS_WIDE = models.SearchParams(
+    hnsw_ef=128,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
+# Offline search upcasts the FP16 embedding file to FP32 this many rows at a time
+OFFLINE_BLOCK_ROWS = 65536
+
+# Fields stored with every vector
+PAYLOAD_FIELDS = ["problem_text", "solution_text", "source", "product_id", "doc_id"]
 
 # Data files
 DATA_FILES = [
@@ -40,18 +82,89 @@ DATA_FILES = [
     "data/cleaned/cleaned_metadata_incident_records.csv",
 ]
 
+def map_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Map one source file onto the retriever fields, keeping only those columns."""
+    # Identify file type and map fields accordingly
+    if 'ProblemDescription' in df.columns and 'SolutionDetails' not in df.columns:
+        # This is src_incident_records - has problem but no solution
+        df['problem_text'] = df['ProblemDescription'].fillna("")
+        df['solution_text'] = ""
+        df['source'] = 'incident_record'
+
+    elif 'step_description' in df.columns:
+        # This is src_tech_records - has solution steps but no problem
+        df['problem_text'] = ""
+        df['solution_text'] = df['step_description'].fillna("")
+        df['source'] = 'tech_record'
+
+    elif 'SolutionDetails' in df.columns:
+        # This is metadata_incident_records - has both problem and solution
+        if 'ProblemDescription' in df.columns:
+            df['problem_text'] = df['ProblemDescription'].fillna("")
+        elif 'ProductInformation' in df.columns:
+            df['problem_text'] = df['ProductInformation'].fillna("")
+        else:
+            df['problem_text'] = ""
+        df['solution_text'] = df['SolutionDetails'].fillna("")
+        df['source'] = 'metadata_incident'
+
+    elif 'SolutionSteps' in df.columns:
+        # This is metadata_tech_records - has solution steps
+        if 'ProductInformation' in df.columns:
+            df['problem_text'] = df['ProductInformation'].fillna("")
+        else:
+            df['problem_text'] = ""
+        df['solution_text'] = df['SolutionSteps'].fillna("")
+        df['source'] = 'metadata_tech'
+
+    else:
+        # Fallback - try to infer from column names
+        problem_cols = [c for c in df.columns if any(x in c.lower() for x in ['description', 'problem', 'issue'])]
+        solution_cols = [c for c in df.columns if any(x in c.lower() for x in ['solution', 'steps', 'detail'])]
+
+        if problem_cols:
+            df['problem_text'] = df[problem_cols].fillna("").astype(str).agg(" ".join, axis=1).str.strip()
+        else:
+            df['problem_text'] = ""
+
+        if solution_cols:
+            df['solution_text'] = df[solution_cols].fillna("").astype(str).agg(" ".join, axis=1).str.strip()
+        else:
+            df['solution_text'] = ""
+
+        df['source'] = 'unknown'
+
+    # Standardize product_id and doc_id fields
+    if 'ProductID' in df.columns:
+        df['product_id'] = df['ProductID'].fillna("").astype(str)
+    elif 'productid' in df.columns:
+        df['product_id'] = df['productid'].fillna("").astype(str)
+    else:
+        df['product_id'] = ""
+
+    if 'DocID' in df.columns:
+        df['doc_id'] = df['DocID'].fillna("").astype(str)
+    elif 'docid' in df.columns:
+        df['doc_id'] = df['docid'].fillna("").astype(str)
+    else:
+        df['doc_id'] = ""
+
+    # Only the mapped fields are kept, so the raw source columns can be freed
+    return df[PAYLOAD_FIELDS]
+
+def iter_processed(paths: list):
+    """Read and map files one at a time so raw frames never all sit in memory together."""
+    for p in paths:
+        raw = read_csv_arrow(p)
+        print(f"✅ Loaded {p} with {len(raw)} records")
+        yield map_schema(raw)
+
 def load_data():
     """Load and merge all data files with proper field mapping."""
-    dfs = []
-    
     # Try to read cleaned files
-    for p in DATA_FILES:
-        if os.path.exists(p):
-            df_temp = pd.read_csv(p)
-            print(f"✅ Loaded {p} with {len(df_temp)} records")
-            dfs.append(df_temp)
+    paths = [p for p in DATA_FILES if os.path.exists(p)]
     
-    if not dfs:
+    if not paths:
         # fallback: attempt to read original dataset files
         candidates = [
             "data/src_tech_records.csv",
@@ -59,86 +172,13 @@ def load_data():
             "data/metadata_tech_records.csv",
             "data/metadata_incident_records.csv",
         ]
-        dfs = [pd.read_csv(p) for p in candidates if os.path.exists(p)]
+        paths = [p for p in candidates if os.path.exists(p)]
     
-    if not dfs:
+    if not paths:
         raise FileNotFoundError("No data files found in data/ or data/cleaned/.")
     
-    # Process each dataframe based on its structure
-    processed_dfs = []
-    
-    for df in dfs:
-        df_copy = df.copy()
-        
-        # Identify file type and map fields accordingly
-        if 'ProblemDescription' in df_copy.columns and 'SolutionDetails' not in df_copy.columns:
-            # This is src_incident_records - has problem but no solution
-            df_copy['problem_text'] = df_copy['ProblemDescription'].fillna("")
-            df_copy['solution_text'] = ""
-            df_copy['source'] = 'incident_record'
-            
-        elif 'step_description' in df_copy.columns:
-            # This is src_tech_records - has solution steps but no problem
-            df_copy['problem_text'] = ""
-            df_copy['solution_text'] = df_copy['step_description'].fillna("")
-            df_copy['source'] = 'tech_record'
-            
-        elif 'SolutionDetails' in df_copy.columns:
-            # This is metadata_incident_records - has both problem and solution
-            if 'ProblemDescription' in df_copy.columns:
-                df_copy['problem_text'] = df_copy['ProblemDescription'].fillna("")
-            elif 'ProductInformation' in df_copy.columns:
-                df_copy['problem_text'] = df_copy['ProductInformation'].fillna("")
-            else:
-                df_copy['problem_text'] = ""
-            df_copy['solution_text'] = df_copy['SolutionDetails'].fillna("")
-            df_copy['source'] = 'metadata_incident'
-            
-        elif 'SolutionSteps' in df_copy.columns:
-            # This is metadata_tech_records - has solution steps
-            if 'ProductInformation' in df_copy.columns:
-                df_copy['problem_text'] = df_copy['ProductInformation'].fillna("")
-            else:
-                df_copy['problem_text'] = ""
-            df_copy['solution_text'] = df_copy['SolutionSteps'].fillna("")
-            df_copy['source'] = 'metadata_tech'
-            
-        else:
-            # Fallback - try to infer from column names
-            problem_cols = [c for c in df_copy.columns if any(x in c.lower() for x in ['description', 'problem', 'issue'])]
-            solution_cols = [c for c in df_copy.columns if any(x in c.lower() for x in ['solution', 'steps', 'detail'])]
-            
-            if problem_cols:
-                df_copy['problem_text'] = df_copy[problem_cols].fillna("").astype(str).agg(" ".join, axis=1).str.strip()
-            else:
-                df_copy['problem_text'] = ""
-                
-            if solution_cols:
-                df_copy['solution_text'] = df_copy[solution_cols].fillna("").astype(str).agg(" ".join, axis=1).str.strip()
-            else:
-                df_copy['solution_text'] = ""
-                
-            df_copy['source'] = 'unknown'
-        
-        # Standardize product_id and doc_id fields
-        if 'ProductID' in df_copy.columns:
-            df_copy['product_id'] = df_copy['ProductID'].fillna("").astype(str)
-        elif 'productid' in df_copy.columns:
-            df_copy['product_id'] = df_copy['productid'].fillna("").astype(str)
-        else:
-            df_copy['product_id'] = ""
-        
-        if 'DocID' in df_copy.columns:
-            df_copy['doc_id'] = df_copy['DocID'].fillna("").astype(str)
-        elif 'docid' in df_copy.columns:
-            df_copy['doc_id'] = df_copy['docid'].fillna("").astype(str)
-        else:
-            df_copy['doc_id'] = ""
-        
-        processed_dfs.append(df_copy)
-    
     # Merge all dataframes
-    df = pd.concat(processed_dfs, ignore_index=True, sort=False)
+    df = pd.concat(iter_processed(paths), ignore_index=True, sort=False, copy=False)
     
     # Clean up text fields
     df['problem_text'] = df['problem_text'].fillna("").astype(str).str.strip()
@@ -157,6 +197,90 @@ def load_data():
     
     return df
 
+# Offline index (embeddings, payloads), loaded lazily on first offline query
+_offline_index = None
+# Incremented on every re-index; part of the search cache key
+_index_generation = 0
+
+def load_offline_index():
+    global _offline_index
+    if _offline_index is None:
+        stored = np.load("models/embeddings.npy", mmap_mode="r")
+        payload_df = pd.read_pickle("models/retriever_payloads.pkl")
+        _offline_index = (stored, payload_df)
+    return _offline_index
+
+def top_k_indices(sims: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first (O(N) partition + sort of k)."""
+    k = min(k, sims.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idxs = np.argpartition(-sims, k - 1)[:k]
+    return idxs[np.argsort(-sims[idxs])]
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _topk_dot_kernel(block, query, k, n_chunks):
+        """
+        Fused dot product + top-k: each parallel chunk of rows keeps its own descending
+        top-k list, so no full score array is allocated. Returns n_chunks * k candidates
+        (index -1 marks unused slots) for the caller to merge.
+        """
+        n, d = block.shape
+        out_idx = np.full((n_chunks, k), -1, np.int64)
+        out_val = np.full((n_chunks, k), np.float32(-1e30), np.float32)
+        chunk = (n + n_chunks - 1) // n_chunks
+        for c in numba.prange(n_chunks):
+            end = min((c + 1) * chunk, n)
+            for i in range(c * chunk, end):
+                score = np.float32(0.0)
+                for j in range(d):
+                    score += block[i, j] * query[j]
+                if score > out_val[c, k - 1]:
+                    pos = k - 1
+                    while pos > 0 and out_val[c, pos - 1] < score:
+                        out_val[c, pos] = out_val[c, pos - 1]
+                        out_idx[c, pos] = out_idx[c, pos - 1]
+                        pos -= 1
+                    out_val[c, pos] = score
+                    out_idx[c, pos] = i
+        return out_idx.ravel(), out_val.ravel()
+
+    if client is None:
+        # offline mode searches with this kernel: compile (or load from the on-disk cache)
+        # now rather than on the first query; Qdrant mode never runs it, so skips the cost
+        _topk_dot_kernel(np.zeros((1, 1), np.float32), np.zeros(1, np.float32), 1, 1)
+
+def block_top_k(block: np.ndarray, query: np.ndarray, k: int):
+    """Return (indices, scores) of the k best rows of one FP32 block, best first."""
+    if numba is not None:
+        idx, val = _topk_dot_kernel(block, query, k, numba.get_num_threads())
+        idx, val = idx[idx >= 0], val[idx >= 0]
+        top = top_k_indices(val, k)
+        return idx[top], val[top]
+    sims = block @ query
+    top = top_k_indices(sims, k)
+    return top, sims[top]
+
+def search_embeddings(stored: np.ndarray, query: np.ndarray, k: int):
+    """
+    Return (indices, scores) of the k rows of `stored` with the highest dot product
+    against `query`, best first. Rows are scored block by block so the FP16 matrix
+    is never upcast to FP32 as a whole; a running top-k is merged after each block.
+    """
+    best_idx = np.empty(0, dtype=np.int64)
+    best_val = np.empty(0, dtype=np.float32)
+    if k <= 0:
+        return best_idx, best_val
+    for start in range(0, stored.shape[0], OFFLINE_BLOCK_ROWS):
+        block = np.ascontiguousarray(stored[start:start + OFFLINE_BLOCK_ROWS], dtype=np.float32)
+        top, vals = block_top_k(block, query, k)
+        best_idx = np.concatenate([best_idx, top + start])
+        best_val = np.concatenate([best_val, vals])
+        keep = top_k_indices(best_val, k)
+        best_idx, best_val = best_idx[keep], best_val[keep]
+    return best_idx, best_val
+
 def setup_qdrant_collection():
     if client is None:
         print("⚠️ Qdrant client not initialized; skipping collection setup.")
@@ -165,103 +289,202 @@ def setup_qdrant_collection():
     if COLLECTION_NAME not in existing:
         client.create_collection(
             collection_name=COLLECTION_NAME,
-            vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
+            vectors_config=models.VectorParams(
+                size=VECTOR_SIZE, distance=models.Distance.COSINE, on_disk=VECTORS_ON_DISK
+            ),
+            # int8 scalar quantization keeps a 4x smaller copy of the vectors in RAM;
+            # original vectors are only read to rescore the oversampled candidates
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True,
+                ),
+            ),
+            hnsw_config=models.HnswConfigDiff(m=HNSW_M, ef_construct=HNSW_EF_CONSTRUCT, on_disk=False),
+            optimizers_config=models.OptimizersConfigDiff(default_segment_number=os.cpu_count() or 1),
         )
         print(f"✅ Created collection: {COLLECTION_NAME}")
     else:
         print(f"✅ Collection '{COLLECTION_NAME}' exists.")
 
+def wait_for_collection_ready(timeout: float = 300.0, poll_interval: float = 1.0) -> bool:
+    """Poll until the collection reports green status (background indexing finished)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if client.get_collection(COLLECTION_NAME).status == models.CollectionStatus.GREEN:
+            return True
+        time.sleep(poll_interval)
+    print(f"⚠️ Collection '{COLLECTION_NAME}' still optimizing after {timeout:.0f}s.")
+    return False
+
+def encode_texts(texts: list, show_progress_bar: bool = True) -> np.ndarray:
+    # encode() length-sorts inputs into batches internally and returns rows in input order,
+    # so larger batches cost little padding; normalized vectors make cosine == dot product
+    return model.encode(
+        texts,
+        batch_size=EMBED_BATCH_SIZE,
+        show_progress_bar=show_progress_bar,
+        convert_to_numpy=True,
+        normalize_embeddings=True,
+    )
+
+def upload_points(embeddings: np.ndarray, payloads: list, ids: list):
+    # upload_collection takes the numpy matrix directly. Stay in-process (parallel=1): each
+    # call with parallel>1 starts a fresh forkserver pool that re-imports __main__ (and with it
+    # the SentenceTransformer) per chunk; the overlap with encoding comes from encode_and_upload
+    client.upload_collection(
+        collection_name=COLLECTION_NAME,
+        vectors=embeddings,
+        payload=payloads,
+        ids=ids,
+        batch_size=UPSERT_BATCH_SIZE,
+        parallel=1,
+    )
+
+def encode_and_upload(texts: list, payloads: list, ids: list):
+    """
+    Encode chunk N+1 while chunk N uploads on a background thread, so the encoder
+    and the network overlap instead of running as two serial phases.
+    """
+    with ThreadPoolExecutor(max_workers=1) as uploader:
+        pending = None
+        for start in range(0, len(texts), INDEX_CHUNK_SIZE):
+            end = min(start + INDEX_CHUNK_SIZE, len(texts))
+            embeddings = encode_texts(texts[start:end], show_progress_bar=False)
+            if pending is not None:
+                pending.result()
+            pending = uploader.submit(upload_points, embeddings, payloads[start:end], ids[start:end])
+            print(f"   - Encoded {end}/{len(texts)} records")
+        if pending is not None:
+            pending.result()
+
 def index_data():
+    global _offline_index, _index_generation
     df = load_data()
     # Combine problem and solution for embedding
     texts = (df["problem_text"].fillna("") + " " + df["solution_text"].fillna("")).tolist()
-    print("⚙️ Generating embeddings locally...")
-    embeddings = model.encode(texts, show_progress_bar=True, convert_to_numpy=True)
-    
-    payloads = []
-    for _, row in df.iterrows():
-        payloads.append({
-            "problem_text": row.get("problem_text", ""),
-            "solution_text": row.get("solution_text", ""),
-            "source": row.get("source", ""),
-            "product_id": row.get("product_id", ""),
-            "doc_id": row.get("doc_id", "")
-        })
+    payloads = df[PAYLOAD_FIELDS].to_dict(orient="records")
 
     if client is None:
-        # Save locally for offline testing
+        print("⚙️ Generating embeddings locally...")
+        embeddings = encode_texts(texts)
+        # Save locally for offline testing; rows are unit-length so search is a plain dot product.
+        # FP16 halves the file and the page cache it occupies once memory-mapped.
         os.makedirs("models", exist_ok=True)
-        np.save("models/embeddings.npy", embeddings)
+        embeddings = embeddings.astype(np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        np.save("models/embeddings.npy", embeddings.astype(np.float16))
         df.to_pickle("models/retriever_payloads.pkl")
+        _offline_index = None
+        _index_generation += 1
         print("⚠️ Qdrant disabled — embeddings saved to models/ for offline testing.")
         return
 
-    print("🚀 Uploading to Qdrant Cloud...")
-    client.upsert(
+    print("⚙️ Generating embeddings locally and uploading to Qdrant Cloud...")
+    # Disable HNSW graph construction during the bulk load; it is built once afterwards
+    client.update_collection(collection_name=COLLECTION_NAME, hnsw_config=models.HnswConfigDiff(m=0))
+    try:
+        encode_and_upload(texts, payloads, df["__id"].tolist())
+    finally:
+        client.update_collection(collection_name=COLLECTION_NAME, hnsw_config=models.HnswConfigDiff(m=HNSW_M))
+    _index_generation += 1
+    print("⏳ Waiting for HNSW index build...")
+    wait_for_collection_ready()
+    print(f"✅ Indexed {len(df)} records into Qdrant Cloud: {COLLECTION_NAME}")
+
+@lru_cache(maxsize=1024)
+def encode_query(query_text: str) -> tuple:
+    """L2-normalized query embedding, cached so repeated queries skip the encoder."""
+    return tuple(model.encode([query_text], normalize_embeddings=True)[0].tolist())
+
+def offline_results(emb: np.ndarray, limit: int):
+    """Cosine search of one normalized query embedding against the offline index."""
+    stored, payload_df = load_offline_index()
+    # cosine similarity (stored embeddings are L2-normalized at index time)
+    idxs, sims = search_embeddings(stored, emb, limit)
+    rows = payload_df.iloc[idxs][PAYLOAD_FIELDS].to_dict(orient="records")
+    results = []
+    for rank, (row, score) in enumerate(zip(rows, sims), start=1):
+        results.append({
+            "rank": rank,
+            "score": float(score),
+            "problem": row["problem_text"],
+            "solution": row["solution_text"],
+            "source": row["source"],
+            "product_id": row["product_id"],
+            "doc_id": row["doc_id"]
+        })
+    return results
+
+def adaptive_top_k(query_text: str) -> int:
+    """Result count by query specificity: short keyword queries need fewer neighbours."""
+    n_words = len(query_text.split())
+    if n_words < 6:
+        return 3
+    return 8 if n_words < 20 else 12
+
+def search_params_for(limit: int):
+    return SEARCH_PARAMS if limit <= 3 else SEARCH_PARAMS_WIDE
+
+def search_records(query_text: str, limit: int = 5):
+    """Uncached search against Qdrant (or the offline index when Qdrant is disabled)."""
+    if client is None:
+        # offline mode: load embeddings & do cosine search locally
+        return offline_results(np.asarray(encode_query(query_text), dtype=np.float32), limit)
+
+    # normal Qdrant query
+    q_vec = list(encode_query(query_text))
+    resp = client.search(
         collection_name=COLLECTION_NAME,
-        points=models.Batch(
-            ids=df["__id"].tolist(),
-            vectors=embeddings.tolist(),
-            payloads=payloads,
-        ),
+        query_vector=q_vec,
+        limit=limit,
+        search_params=search_params_for(limit),
     )
-    print(f"✅ Indexed {len(df)} records into Qdrant Cloud: {COLLECTION_NAME}")
+    return qdrant_results(resp)
 
-def retrieve_qdrant(query_text: str, limit: int = 5):
+def qdrant_results(resp):
+    """Convert Qdrant scored points into retriever result dicts."""
+    results = []
+    for rank, r in enumerate(resp, start=1):
+        payload = r.payload or {}
+        score = getattr(r, "score", None)
+        score = float(score) if score is not None else 0.0
+        results.append({
+            "rank": rank,
+            "score": score,
+            "problem": payload.get("problem_text", ""),
+            "solution": payload.get("solution_text", ""),
+            "source": payload.get("source", ""),
+            "product_id": payload.get("product_id", ""),
+            "doc_id": payload.get("doc_id", "")
+        })
+
+    if not results:
+        results.append({
+            "rank": 0, "score": 0.0,
+            "problem": "No similar records found",
+            "solution": "Please try rephrasing your query or contact support.",
+            "source": "N/A",
+            "product_id": "",
+            "doc_id": ""
+        })
+    return results
+
+@lru_cache(maxsize=1024)
+def cached_search(query_text: str, limit: int, generation: int) -> tuple:
+    # generation is only part of the cache key: index_data bumps it so stale hits are never served
+    return tuple(tuple(r.items()) for r in search_records(query_text, limit))
+
+def retrieve_qdrant(query_text: str, limit: int = None):
     """
     Return list of dicts: rank, score, problem, solution, source, product_id, doc_id
+    (limit=None picks the result count from the query length).
     """
+    if limit is None:
+        limit = adaptive_top_k(query_text)
     try:
-        if client is None:
-            # offline mode: load embeddings & do cosine search locally
-            import numpy as np
-            emb = model.encode([query_text])[0]
-            stored = np.load("models/embeddings.npy")
-            # cosine similarity
-            sims = (stored @ emb) / (np.linalg.norm(stored, axis=1) * np.linalg.norm(emb) + 1e-12)
-            idxs = sims.argsort()[::-1][:limit]
-            results = []
-            payload_df = pd.read_pickle("models/retriever_payloads.pkl")
-            for rank, i in enumerate(idxs, start=1):
-                results.append({
-                    "rank": rank,
-                    "score": float(sims[i]),
-                    "problem": payload_df.iloc[i].get("problem_text", ""),
-                    "solution": payload_df.iloc[i].get("solution_text", ""),
-                    "source": payload_df.iloc[i].get("source", ""),
-                    "product_id": payload_df.iloc[i].get("product_id", ""),
-                    "doc_id": payload_df.iloc[i].get("doc_id", "")
-                })
-            return results
-
-        # normal Qdrant query
-        q_vec = model.encode([query_text])[0].tolist()
-        resp = client.search(collection_name=COLLECTION_NAME, query_vector=q_vec, limit=limit)
-        results = []
-        for rank, r in enumerate(resp, start=1):
-            payload = r.payload or {}
-            score = getattr(r, "score", None)
-            score = float(score) if score is not None else 0.0
-            results.append({
-                "rank": rank,
-                "score": score,
-                "problem": payload.get("problem_text", ""),
-                "solution": payload.get("solution_text", ""),
-                "source": payload.get("source", ""),
-                "product_id": payload.get("product_id", ""),
-                "doc_id": payload.get("doc_id", "")
-            })
-        
-        if not results:
-            results.append({
-                "rank": 0, "score": 0.0,
-                "problem": "No similar records found",
-                "solution": "Please try rephrasing your query or contact support.",
-                "source": "N/A",
-                "product_id": "",
-                "doc_id": ""
-            })
-        return results
+        return [dict(r) for r in cached_search(query_text, limit, _index_generation)]
     except Exception as e:
         print("❌ Retrieval error:", e)
         return [{
@@ -273,6 +496,34 @@ def retrieve_qdrant(query_text: str, limit: int = 5):
             "doc_id": ""
         }]
 
+def retrieve_qdrant_batch(queries: list, limit: int = 5):
+    """
+    Retrieve for several queries at once: one encoder call and one search_batch request.
+    Returns one result list per query, in the same order.
+    """
+    try:
+        embs = model.encode(queries, batch_size=max(len(queries), 1), normalize_embeddings=True, convert_to_numpy=True)
+        if client is None:
+            return [offline_results(emb.astype(np.float32), limit) for emb in embs]
+        responses = client.search_batch(
+            collection_name=COLLECTION_NAME,
+            requests=[
+                models.SearchRequest(vector=emb.tolist(), limit=limit, params=search_params_for(limit), with_payload=True)
+                for emb in embs
+            ],
+        )
+        return [qdrant_results(resp) for resp in responses]
+    except Exception as e:
+        print("❌ Batch retrieval error:", e)
+        return [[{
+            "rank": 0, "score": 0.0,
+            "problem": "Error during retrieval",
+            "solution": str(e),
+            "source": "Error",
+            "product_id": "",
+            "doc_id": ""
+        }] for _ in queries]
+
 # small alias for imports
 retrieve_from_qdrant = retrieve_qdrant
 
@@ -8,22 +8,317 @@ Automatically handles retriever confidence, hybrid reasoning, and fallback logic
 from dotenv import load_dotenv
 load_dotenv()
 
+import os
+from pathlib import Path
+
+# Persist compiled kernels across restarts so only the first ever start pays the JIT cost
+os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(Path.home() / ".cache" / "bluecom" / "inductor"))
+os.environ.setdefault("TRITON_CACHE_DIR", str(Path.home() / ".cache" / "bluecom" / "triton"))
 import json
+import asyncio
+import time
+import queue
+import threading
+import importlib.util
+from concurrent.futures import Future
+from contextvars import ContextVar
+import torch
 from langgraph.graph import StateGraph, END
 from typing import Dict, Any
-from step2_retriever_qdrant import retrieve_from_qdrant
-from transformers import pipeline
+from step2_retriever_qdrant import adaptive_top_k, encode_query, retrieve_from_qdrant
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, pipeline
+from transformers import StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
+
+LLM_MODEL = os.getenv("LLM_MODEL", "google/gemma-2b-it")
+# hf (transformers pipeline), vllm (paged-attention engine, GPU), onnx (ONNX Runtime, CPU)
+# or gguf (llama.cpp with a quantized GGUF file, CPU)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "hf").lower()
+# e.g. a Q4_K_M quantization of gemma-2b-it; only used by the gguf backend
+LLM_GGUF_PATH = os.getenv("LLM_GGUF_PATH", "models/gemma-2b-it.Q4_K_M.gguf")
+MAX_NEW_TOKENS = int(os.getenv("MAX_TOKENS", "220"))
+REPETITION_PENALTY = 1.5
+# Prompts arriving within this window (or up to this many) are generated as one batch
+BATCH_MAX_SIZE = 8
+BATCH_WINDOW_S = 0.02
+# The reasoner starts on the fast top-k while the full (adaptive) top-k is still being retrieved
+RETRIEVE_FAST_K = 3
+# torch.compile the bf16 Gemma forward on CUDA (set LLM_COMPILE=0 to skip the one-time compile)
+LLM_COMPILE = os.getenv("LLM_COMPILE", "1") == "1"
 
 # ========================================
 # 🧠 Load Local HuggingFace LLM (Gemma 2B)
 # ========================================
-print("🧠 Loading local reasoning model (google/gemma-2b-it)...")
+print(f"🧠 Loading local reasoning model ({LLM_MODEL}, backend={LLM_BACKEND})...")
+llm = None
+tokenizer = None
+sampling_params = None
 try:
-    llm = pipeline("text-generation", model="google/gemma-2b-it")
+    if LLM_BACKEND == "vllm":
+        from vllm import LLM, SamplingParams
+        llm = LLM(model=LLM_MODEL, dtype="bfloat16", gpu_memory_utilization=0.6)
+        # temperature=0 is greedy decoding, same as the transformers path
+        sampling_params = SamplingParams(
+            max_tokens=MAX_NEW_TOKENS,
+            temperature=0.0,
+            repetition_penalty=REPETITION_PENALTY,
+        )
+    elif LLM_BACKEND == "gguf":
+        from llama_cpp import Llama
+        llm = Llama(model_path=LLM_GGUF_PATH, n_ctx=2048, n_threads=torch.get_num_threads(), verbose=False)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(LLM_MODEL)
+        if LLM_BACKEND == "onnx":
+            from optimum.onnxruntime import ORTModelForCausalLM
+            llm_model = ORTModelForCausalLM.from_pretrained(
+                LLM_MODEL, export=True, provider="CPUExecutionProvider"
+            )
+        else:
+            # fused scaled-dot-product attention (FlashAttention-2 kernels when installed)
+            attn = "flash_attention_2" if torch.cuda.is_available() and importlib.util.find_spec("flash_attn") else "sdpa"
+            model_kwargs = {"attn_implementation": attn}
+            quantized = False
+            if torch.cuda.is_available():
+                # bf16 weights (half of fp32), placed across available GPUs
+                model_kwargs.update({"torch_dtype": torch.bfloat16, "device_map": "auto"})
+                if importlib.util.find_spec("bitsandbytes") is not None:
+                    quantized = True
+                    # 4-bit NF4 weights: ~4x smaller than bf16, fits 8 GB cards
+                    model_kwargs["quantization_config"] = BitsAndBytesConfig(
+                        load_in_4bit=True,
+                        bnb_4bit_quant_type="nf4",
+                        bnb_4bit_use_double_quant=True,
+                        bnb_4bit_compute_dtype=torch.bfloat16,
+                    )
+            llm_model = AutoModelForCausalLM.from_pretrained(LLM_MODEL, **model_kwargs)
+        llm = pipeline("text-generation", model=llm_model, tokenizer=tokenizer)
+        if LLM_BACKEND == "hf" and LLM_COMPILE and torch.cuda.is_available() and not quantized:
+            # compile forward only, so generate()/pipeline still see the original model;
+            # dynamic shapes avoid a recompile for every prompt and KV-cache length
+            eager_forward = llm_model.forward
+            llm_model.forward = torch.compile(eager_forward, dynamic=True)
+            try:
+                # pay the compile cost at startup, not on the first query
+                llm("Warmup", max_new_tokens=4, do_sample=False, pad_token_id=tokenizer.eos_token_id)
+            except Exception as e:
+                print(f"⚠️ torch.compile failed, using eager model: {e}")
+                llm_model.forward = eager_forward
     print("✅ Gemma 2B-Instruct model loaded successfully.")
 except Exception as e:
     print(f"⚠️ LLM load failed: {e}")
     llm = None
+    tokenizer = None
+
+
+class BatchStreamer(BaseStreamer):
+    """Decodes each row of a batched generate() and pushes its new text to that row's sink."""
+
+    def __init__(self, sinks: list):
+        self.sinks = sinks
+        self.tokens = [[] for _ in sinks]
+        self.sent = [0] * len(sinks)
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            # the first call carries the prompt ids
+            self.prompt_seen = True
+            return
+        for i, token in enumerate(value.tolist()):
+            if self.sinks[i] is None:
+                continue
+            self.tokens[i].append(token)
+            text = tokenizer.decode(self.tokens[i], skip_special_tokens=True)
+            if text.endswith("\ufffd"):
+                continue  # wait for the rest of a multi-byte character
+            if len(text) > self.sent[i]:
+                self.sinks[i].put(text[self.sent[i]:])
+                self.sent[i] = len(text)
+
+    def end(self):
+        pass
+
+
+class DiscardedRowsStop(StoppingCriteria):
+    """
+    Ends a batched generate() once every row still decoding has its stop event set
+    (a discarded speculation); transformers 4.36 can only stop the batch as a whole.
+    """
+
+    def __init__(self, stops: list):
+        self.stops = stops
+
+    def __call__(self, input_ids, scores, **kwargs) -> bool:
+        # finished rows are padded with eos
+        finished = (input_ids[:, -1] == tokenizer.eos_token_id).tolist()
+        return all(done or (stop is not None and stop.is_set()) for done, stop in zip(finished, self.stops))
+
+
+def generate_batch(prompts: list, sinks: list, stops: list) -> list:
+    """
+    Run prompts through the loaded backend; each output is prompt + completion like the HF pipeline.
+    Text is pushed to the matching sink (anything with put(), or None) as it is generated, and a
+    prompt whose stop event (threading.Event, or None) is set stops decoding where the backend allows.
+    """
+    if LLM_BACKEND in ("vllm", "gguf"):
+        if LLM_BACKEND == "vllm":
+            outputs = llm.generate(prompts, sampling_params, use_tqdm=False)
+            completions = [o.outputs[0].text for o in outputs]
+        else:
+            # llama.cpp decodes one sequence at a time; discarded prompts are skipped
+            completions = [
+                "" if stop is not None and stop.is_set() else
+                llm(p, max_tokens=MAX_NEW_TOKENS, temperature=0.0, repeat_penalty=REPETITION_PENALTY)["choices"][0]["text"]
+                for p, stop in zip(prompts, stops)
+            ]
+        # these engines hand back whole completions
+        for sink, completion in zip(sinks, completions):
+            if sink is not None:
+                sink.put(completion)
+        return [p + c for p, c in zip(prompts, completions)]
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(llm.model.device)
+    streamer = BatchStreamer(sinks) if any(sink is not None for sink in sinks) else None
+    stopping = StoppingCriteriaList([DiscardedRowsStop(stops)]) if any(stop is not None for stop in stops) else None
+    output_ids = llm.model.generate(
+        **inputs,
+        streamer=streamer,
+        stopping_criteria=stopping,
+        max_new_tokens=MAX_NEW_TOKENS,
+        do_sample=False,
+        repetition_penalty=REPETITION_PENALTY,
+        pad_token_id=tokenizer.eos_token_id,
+        use_cache=True
+    )
+    completions = tokenizer.batch_decode(output_ids[:, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+    return [p + c for p, c in zip(prompts, completions)]
+
+
+# ========================================
+# 🧺 Prompt Micro-Batcher
+# ========================================
+class PromptBatcher:
+    """
+    Collects prompts from concurrent graph invocations (Streamlit runs each session
+    in its own thread) and generates them as a single batch on a worker thread.
+    """
+
+    def __init__(self, generate_fn, max_batch_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_WINDOW_S):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="llm-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, prompt: str, sink=None, stop: threading.Event = None) -> Future:
+        future = Future()
+        self._queue.put((prompt, sink, stop, future))
+        return future
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # drop prompts whose caller cancelled them while they were queued
+            batch = [item for item in self._next_batch() if item[-1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            prompts, sinks, stops, futures = zip(*batch)
+            try:
+                outputs = self.generate_fn(list(prompts), list(sinks), list(stops))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+
+if llm is not None and tokenizer is not None:
+    # decoder-only models must be left-padded when prompts are batched
+    tokenizer.padding_side = "left"
+batcher = PromptBatcher(generate_batch) if llm is not None else None
+
+
+# Queue that receives Gemma's text chunks as they decode; set per run by callers that
+# render the answer live (the Streamlit app). None means nothing is streamed.
+token_stream = ContextVar("token_stream", default=None)
+
+
+class HeldSink:
+    """Buffers a speculative generation's text until the run claims it, then forwards it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chunks = []
+        self._target = None
+
+    def put(self, chunk: str):
+        with self._lock:
+            if self._target is None:
+                self._chunks.append(chunk)
+            else:
+                self._target.put(chunk)
+
+    def attach(self, target):
+        with self._lock:
+            for chunk in self._chunks:
+                target.put(chunk)
+            self._chunks.clear()
+            self._target = target
+
+
+# Per-run speculative generation ({"prompt", "future", "sink", "stop"}); run_graph
+# installs a fresh dict for every query so runs never see each other's prompts
+_speculation = ContextVar("speculation", default=None)
+
+
+def speculate(prompt: str):
+    """Start generating a prompt before the reasoner node asks for it."""
+    spec = _speculation.get()
+    if spec is None:
+        return
+    discard_speculation()
+    # hold streamed text back until the reasoner confirms this is the prompt it wants
+    sink = HeldSink() if token_stream.get() is not None else None
+    # set on discard so a speculation the batcher already started stops decoding
+    stop = threading.Event()
+    spec.update(prompt=prompt, sink=sink, stop=stop, future=batcher.submit(prompt, sink, stop))
+
+
+def discard_speculation():
+    """Cancel this run's speculative prompt if nothing claimed it, or stop it if already decoding."""
+    spec = _speculation.get()
+    if spec and spec.get("future") is not None:
+        spec.pop("stop").set()
+        spec.pop("future").cancel()
+        spec.pop("prompt", None)
+        spec.pop("sink", None)
+
+
+def generate_text(prompt: str) -> str:
+    """Generate for one prompt, sharing a batch with any concurrent requests."""
+    sink = token_stream.get()
+    spec = _speculation.get()
+    if spec and spec.get("prompt") == prompt:
+        spec.pop("prompt")
+        held = spec.pop("sink")
+        spec.pop("stop")
+        if held is not None and sink is not None:
+            held.attach(sink)
+        return spec.pop("future").result()
+    return batcher.submit(prompt, sink).result()
 
 # ========================================
 # ⚙️ Configuration
@@ -44,11 +339,47 @@ class AgentState(dict):
 # ========================================
 # 🔍 Retriever Node
 # ========================================
-def retriever_node(state: AgentState):
+def select_mode(results: list) -> str:
+    """Reasoning mode implied by the retriever results (same thresholds as decide_next)."""
+    top_score = float(results[0].get("score", 0.0)) if results else 0.0
+    if not results or results[0].get("source", "").lower() == "error" or top_score == 0.0:
+        return "fallback"
+    if top_score >= HIGH_CONF:
+        return "retriever-only"
+    if top_score >= MEDIUM_CONF:
+        return "hybrid"
+    return "fallback"
+
+
+async def retriever_node(state: AgentState):
     print("\n🔍 Agent 1 (Retriever) active...")
     q = state.get("query", "")
-    results = retrieve_from_qdrant(q)
+    # encode once; both searches below hit encode_query's cache
+    try:
+        await asyncio.to_thread(encode_query, q)
+    except Exception:
+        pass  # retrieve_from_qdrant reports the failure as an error record
+    full_k = adaptive_top_k(q)
+    full = asyncio.create_task(asyncio.to_thread(retrieve_from_qdrant, q, full_k))
+
+    # Speculative overlap: Gemma starts on the fast top-k while the full search finishes
+    speculative_prompt = None
+    # short queries already search only RETRIEVE_FAST_K, so a fast pass would duplicate the full one
+    if batcher is not None and _speculation.get() is not None and full_k > RETRIEVE_FAST_K:
+        fast = await asyncio.to_thread(retrieve_from_qdrant, q, RETRIEVE_FAST_K)
+        mode = select_mode(fast)
+        if mode != "retriever-only":
+            speculative_prompt = build_prompt(q, fast, mode)
+            speculate(speculative_prompt)
+
+    results = await full
+    mode = select_mode(results)
+    if speculative_prompt is not None and speculative_prompt != build_prompt(q, results, mode):
+        print("♻️ Full retrieval changed the context → restarting Gemma")
+        discard_speculation()
     state["results"] = results
+    # set here: LangGraph drops state written inside the conditional-edge function
+    state["mode"] = mode
 
     top_score = float(results[0].get("score", 0.0)) if results else 0.0
     state["confidence"] = top_score
@@ -59,20 +390,18 @@ def retriever_node(state: AgentState):
 # ========================================
 # 🧠 Reasoner Node (Gemma 2B)
 # ========================================
-def reason_with_local_llm(query, retrieved_docs, mode):
-    """
-    Uses Gemma 2B Instruct to generate structured troubleshooting steps.
-    Produces technically sound, human-readable, and relevant solutions.
-    """
-    FALLBACK_STEPS = [
-        "Check cable and power connections.",
-        "Restart the affected network device.",
-        "Verify IP assignment and DHCP lease.",
-        "Test DNS and routing paths.",
-        "Review firewall, VLAN, or VPN settings.",
-        "Check logs and recent firmware updates."
-    ]
-
+FALLBACK_STEPS = [
+    "Check cable and power connections.",
+    "Restart the affected network device.",
+    "Verify IP assignment and DHCP lease.",
+    "Test DNS and routing paths.",
+    "Review firewall, VLAN, or VPN settings.",
+    "Check logs and recent firmware updates."
+]
+
+
+def build_prompt(query, retrieved_docs, mode):
+    """Gemma prompt for a query, its retrieved context and the reasoning mode."""
     # Prepare retriever context - filter out empty docs
     valid_docs = [doc for doc in retrieved_docs[:3] if doc.get('problem', '').strip() or doc.get('solution', '').strip()]
     
@@ -124,17 +453,20 @@ Customer issue: {query}
 No historical matches found.
 Generate 3–5 helpful troubleshooting steps that are general, logical, and relevant to the issue.
 """
+    return prompt.strip()
+
+
+def reason_with_local_llm(query, retrieved_docs, mode):
+    """
+    Uses Gemma 2B Instruct to generate structured troubleshooting steps.
+    Produces technically sound, human-readable, and relevant solutions.
+    """
+    prompt = build_prompt(query, retrieved_docs, mode)
 
     # --- Call Gemma 2B ---
     if llm:
         try:
-            response = llm(
-                prompt.strip(),
-                max_new_tokens=220,
-                temperature=0.8,
-                top_p=0.9,
-                repetition_penalty=1.5
-            )[0]["generated_text"]
+            response = generate_text(prompt)
 
             response = response.strip().replace("\n\n", "\n")
             if len(response) < 30:
@@ -150,13 +482,14 @@ Generate 3–5 helpful troubleshooting steps that are general, logical, and rele
 # ========================================
 # 🧠 Reasoner Node Wrapper
 # ========================================
-def reasoner_node(state: AgentState):
+async def reasoner_node(state: AgentState):
     print("🧠 Agent 2 (Reasoner via local Gemma 2B) active...")
     q = state.get("query", "")
     retrieved_docs = state.get("results", [])
     mode = state.get("mode", "fallback")
 
-    reasoning_output = reason_with_local_llm(q, retrieved_docs, mode)
+    # to_thread carries the caller's context (token_stream) into the generating thread
+    reasoning_output = await asyncio.to_thread(reason_with_local_llm, q, retrieved_docs, mode)
 
     state["reasoner_output"] = {
         "query": q,
@@ -225,13 +558,26 @@ graph.add_edge("reasoner", END)
 app = graph.compile()
 
 
+async def run_graph(query: str, sink=None) -> dict:
+    """
+    Run the graph for one query, streaming Gemma's text into `sink` (a queue) when given;
+    a speculative generation nobody claimed is cancelled.
+    """
+    token_stream.set(sink)
+    _speculation.set({})
+    try:
+        return await app.ainvoke({"query": query})
+    finally:
+        discard_speculation()
+
+
 # ========================================
 # 🧾 CLI Test Runner (for debugging)
 # ========================================
 if __name__ == "__main__":
     print("\n💬 BlueCom Dual-Agent (Retriever + Gemma 2B)\n--------------------------------------------")
     q = input("Describe your network issue:\n> ")
-    state = app.invoke({"query": q})
+    state = asyncio.run(run_graph(q))
 
     out = state.get("reasoner_output", {})
     confidence = state.get("confidence", out.get("best_score", 0.0))
@@ -6,12 +6,21 @@ Logs feedback locally and uploads it to S3.
 """
 
 import os
-import csv
-from datetime import datetime
+import time
+import atexit
+import uuid
+import queue
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import lru_cache
+import pyarrow as pa
+import pyarrow.dataset as pads
 import streamlit as st
 import boto3
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
-from step5_langgraph_triple import app
 
 # Load environment variables
 load_dotenv()
@@ -19,8 +28,43 @@ load_dotenv()
 # ==============================
 # ☁️ S3 Upload Helper
 # ==============================
-def upload_feedback_to_s3(local_path="logs/feedback.csv"):
-    """Upload feedback file to S3 bucket."""
+S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=S3_MULTIPART_THRESHOLD,
+    max_concurrency=8,
+    use_threads=True
+)
+# Feedback rows are flushed (one new Parquet part file + its S3 upload) every N rows or T seconds
+FEEDBACK_BATCH_ROWS = 5
+FEEDBACK_FLUSH_S = 10.0
+# a failed write is retried with a growing delay before its rows are given up
+FEEDBACK_WRITE_ATTEMPTS = 3
+FEEDBACK_RETRY_S = 2.0
+FEEDBACK_S3_PREFIX = "feedback_logs"
+FEEDBACK_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("s", tz="UTC")),
+    ("query", pa.string()),
+    ("confidence", pa.float64()),
+    ("mode", pa.string()),
+    ("status", pa.string()),
+    ("answer", pa.string()),
+    ("date", pa.string()),  # hive partition key
+])
+
+
+@lru_cache(maxsize=None)
+def get_s3_client(aws_access_key, aws_secret_key, aws_region):
+    """Create the S3 client once per process so credentials, region and TLS sessions are reused."""
+    return boto3.client(
+        "s3",
+        aws_access_key_id=aws_access_key,
+        aws_secret_access_key=aws_secret_key,
+        region_name=aws_region
+    )
+
+
+def upload_feedback_to_s3(local_path, s3_key):
+    """Upload one feedback part file to S3 (runs on the feedback writer thread, so it only logs)."""
     try:
         # Get credentials from environment variables
         aws_access_key = os.getenv("AWS_ACCESS_KEY_ID")
@@ -29,27 +73,257 @@ def upload_feedback_to_s3(local_path="logs/feedback.csv"):
         bucket_name = os.getenv("S3_BUCKET_NAME", "netro-network-data")
         
         if not aws_access_key or not aws_secret_key:
-            st.warning("⚠️ AWS credentials not configured. Feedback saved locally only.")
+            print("⚠️ AWS credentials not configured. Feedback saved locally only.")
             return
         
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key,
-            region_name=aws_region
-        )
-        
-        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        s3_key = f"feedback_logs/{timestamp}_feedback.csv"
+        s3 = get_s3_client(aws_access_key, aws_secret_key, aws_region)
 
         print(f"⬆️ Uploading {local_path} to s3://{bucket_name}/{s3_key}")
-        s3.upload_file(local_path, bucket_name, s3_key)
-        st.success(f"✅ Feedback uploaded to S3 as {s3_key}")
+        if os.path.getsize(local_path) < S3_MULTIPART_THRESHOLD:
+            # small files: a single PUT skips the multipart handshake
+            with open(local_path, "rb") as f:
+                s3.put_object(Bucket=bucket_name, Key=s3_key, Body=f)
+        else:
+            s3.upload_file(local_path, bucket_name, s3_key, Config=S3_TRANSFER_CONFIG)
+        print(f"✅ Feedback uploaded to S3 as {s3_key}")
     except Exception as e:
-        st.warning(f"⚠️ Failed to upload feedback to S3: {e}")
         print(f"❌ Upload error: {e}")
 
 
+class FeedbackWriter:
+    """
+    Buffers feedback rows and writes them on a background thread as a new Parquet part
+    file under a hive-partitioned dataset (<base_dir>/date=YYYY-MM-DD/part-*.parquet).
+    Only the new part files are uploaded to S3, so button clicks never wait on disk or
+    network I/O and each flush transfers just its own rows.
+    """
+
+    def __init__(self, base_dir, batch_rows: int = FEEDBACK_BATCH_ROWS, flush_interval: float = FEEDBACK_FLUSH_S):
+        self.base_dir = base_dir
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+        self._worker.start()
+
+    def submit(self, row: tuple):
+        """Queue (unix_time, *fields); timestamps are formatted per batch on the writer thread."""
+        self._queue.put(row)
+
+    def close(self, timeout: float = 30.0):
+        """Write every queued row before the process exits."""
+        self._queue.put(None)
+        self._worker.join(timeout)
+
+    def _next_batch(self) -> list:
+        rows = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        # None is the close() marker; it ends the batch early
+        while len(rows) < self.batch_rows and rows[-1] is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                rows.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return rows
+
+    def _write_parquet(self, records: list) -> list:
+        """Write one batch as new part files; returns their paths."""
+        written = []
+        pads.write_dataset(
+            pa.Table.from_pylist(records, schema=FEEDBACK_SCHEMA),
+            self.base_dir,
+            format="parquet",
+            partitioning=["date"],
+            partitioning_flavor="hive",
+            # unique per flush so earlier part files are never overwritten
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_visitor=lambda written_file: written.append(written_file.path),
+        )
+        return written
+
+    def _flush(self, rows: list):
+        records = []
+        for ts, query, confidence, mode, status, answer in rows:
+            stamp = datetime.fromtimestamp(ts, tz=timezone.utc)
+            records.append({
+                "timestamp": stamp, "query": query, "confidence": float(confidence),
+                "mode": mode, "status": status, "answer": answer, "date": stamp.date().isoformat(),
+            })
+        for attempt in range(1, FEEDBACK_WRITE_ATTEMPTS + 1):
+            try:
+                written = self._write_parquet(records)
+                break
+            except Exception as e:
+                print(f"❌ Feedback write error (attempt {attempt}/{FEEDBACK_WRITE_ATTEMPTS}): {e}")
+                if attempt == FEEDBACK_WRITE_ATTEMPTS:
+                    print(f"❌ Dropped {len(records)} feedback rows")
+                    return
+                time.sleep(FEEDBACK_RETRY_S * attempt)
+        print(f"📝 Flushed {len(records)} feedback rows to {self.base_dir}")
+        for path in written:
+            rel_path = os.path.relpath(path, self.base_dir).replace(os.sep, "/")
+            upload_feedback_to_s3(path, f"{FEEDBACK_S3_PREFIX}/{rel_path}")
+
+    def _run(self):
+        while True:
+            rows = self._next_batch()
+            closing = rows[-1] is None
+            if closing:
+                rows.pop()
+            if rows:
+                self._flush(rows)
+            if closing:
+                return
+
+
+@st.cache_resource(show_spinner=False)
+def get_feedback_writer(base_dir):
+    """One writer thread per process; Streamlit reruns reuse it and shutdown drains it."""
+    writer = FeedbackWriter(base_dir)
+    atexit.register(writer.close)
+    return writer
+
+
+# ==============================
+# 🧠 Model Handles
+# ==============================
+WARMUP_QUERY = "router not assigning IP address"
+
+
+@st.cache_resource(show_spinner="🧠 Loading retriever and Gemma models...")
+def get_agent():
+    """
+    Import the agent module (which loads the encoder and Gemma) once per process.
+    The handle survives script reruns and Streamlit's reload of edited local modules.
+    """
+    import torch
+    # Cap intra-op threads (max 8) and leave a core free for the Qdrant/Streamlit I/O threads;
+    # set here so the bulk indexer, which also imports step2, keeps every core
+    torch.set_num_threads(max(1, min((os.cpu_count() or 2) - 1, 8)))
+    import step5_langgraph_triple
+    # one canonical query warms the encoder, the Qdrant channel and Gemma's kernels
+    try:
+        asyncio.run(step5_langgraph_triple.run_graph(WARMUP_QUERY))
+    except Exception as e:
+        print(f"⚠️ Warmup query failed: {e}")
+    return step5_langgraph_triple
+
+
+def stream_agents(query, placeholder):
+    """
+    Run the dual-agent graph on a worker thread and render Gemma's tokens into
+    `placeholder` as they are generated; returns the final graph state.
+    """
+    agent = get_agent()
+    tokens = queue.Queue()
+    outcome = {}
+
+    def work():
+        try:
+            outcome["result"] = asyncio.run(agent.run_graph(query, tokens))
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            tokens.put(None)
+
+    worker = threading.Thread(target=work, name="agent-run", daemon=True)
+    worker.start()
+    text = ""
+    for chunk in iter(tokens.get, None):
+        text += chunk
+        placeholder.markdown(f"**🧠 Gemma is writing...**\n\n{text}▌")
+    worker.join()
+    placeholder.empty()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+# ==============================
+# 🗃️ Agent Result Cache
+# ==============================
+AGENT_CACHE_TTL_S = 3600
+AGENT_CACHE_MAX_ENTRIES = 256
+
+
+class AgentResultCache:
+    """
+    LRU + TTL cache of agent results keyed on the normalized query, shared by all sessions.
+    (st.cache_data replays st.* calls made inside the cached function, so it cannot wrap
+    the streamed run.)
+    """
+
+    def __init__(self, ttl: float = AGENT_CACHE_TTL_S, max_entries: int = AGENT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            self.lookups += 1
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+@st.cache_resource(show_spinner=False)
+def get_agent_cache():
+    return AgentResultCache()
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive cache key for a query."""
+    return " ".join(query.lower().split())
+
+
+def is_cacheable(result):
+    """Only healthy runs are cached; a retrieval error or Gemma fallback should be retried next time."""
+    results = result.get("results") or []
+    if results and results[0].get("source") == "Error":
+        return False
+    answer = result.get("reasoner_output", {}).get("answer", "")
+    return "Gemma generation failed" not in answer and "Gemma unavailable" not in answer
+
+
+# ==============================
+# 🧾 Result Rendering
+# ==============================
+@st.cache_data(show_spinner=False, max_entries=1024)
+def render_result(r_tuple):
+    """Expander label, body markdown and caption for one retriever hit; reruns reuse the strings."""
+    idx, score, src, problem, solution, product_id, doc_id = r_tuple
+    # Show appropriate label based on what's available
+    label = f"Result {idx} | Score: {score:.2f} | Source: {src}"
+    body = "\n\n".join([
+        f"**Problem:** {problem}" if problem else "**Problem:** _(Not available)_",
+        f"**Solution:** {solution}" if solution else "**Solution:** _(Not available)_",
+    ])
+    caption = f"**Product:** {product_id or 'N/A'} — **DocID:** {doc_id or 'N/A'}" if product_id or doc_id else ""
+    return label, body, caption
+
+
 # ==============================
 # ⚙️ App Initialization
 # ==============================
@@ -57,9 +331,12 @@ st.set_page_config(page_title="BlueCom Troubleshooter", page_icon="⚡", layout=
 st.title("⚡ BlueCom Network Troubleshooter Agent")
 st.markdown("🧠 Dual-Agent System — Agent 1 (Retriever) + Agent 2 (Local Gemma 2B-Instruct Reasoner)")
 
+# Load models up front (cached) so the first query doesn't pay the cold start
+get_agent()
+
 # Ensure log directory exists
 os.makedirs("logs", exist_ok=True)
-feedback_file = os.path.join("logs", "feedback.csv")
+feedback_dir = os.path.join("logs", "feedback")
 
 # Initialize session state
 if "result" not in st.session_state:
@@ -83,9 +360,23 @@ if st.button("🔍 Analyze Issue"):
         st.warning("Please enter a problem description.")
     else:
         st.session_state.query = query
-        with st.spinner("🤖 Engaging Dual Agents (Retriever + Gemma Reasoner)..."):
-            result = app.invoke({"query": query})
-            st.session_state.result = result
+        cache = get_agent_cache()
+        key = normalize_query(query)
+        result = cache.get(key)
+        if result is None:
+            with st.spinner("🤖 Engaging Dual Agents (Retriever + Gemma Reasoner)..."):
+                result = stream_agents(query, st.empty())
+            if is_cacheable(result):
+                cache.put(key, result)
+        st.session_state.result = result
+
+with st.sidebar.expander("📈 Agent Cache"):
+    cache = get_agent_cache()
+    hits = cache.lookups - cache.misses
+    st.metric("Hit Ratio", f"{hits / cache.lookups:.0%}" if cache.lookups else "—")
+    st.caption(f"Lookups: {cache.lookups} — Hits: {hits} — Misses: {cache.misses}")
+    if st.button("🧹 Clear Cache"):
+        cache.clear()
 
 
 # ==============================
@@ -128,30 +419,17 @@ if st.session_state.result:
         st.markdown("### Agent 1 — Retriever 🔍")
         if retriever_results:
             for idx, r in enumerate(retriever_results, start=1):
-                score = r.get("score", 0.0)
-                src = r.get("source", "")
                 problem_text = r.get('problem', '').strip()
                 solution_text = r.get('solution', '').strip()
-                
-                # Show appropriate label based on what's available
-                result_label = f"Result {idx} | Score: {score:.2f} | Source: {src}"
+                result_label, body, caption = render_result((
+                    idx, float(r.get("score", 0.0)), r.get("source", ""), problem_text[:500], solution_text[:800],
+                    r.get('product_id', '').strip(), r.get('doc_id', '').strip(),
+                ))
                 
                 with st.expander(result_label):
-                    if problem_text:
-                        st.markdown(f"**Problem:** {problem_text[:500]}")
-                    else:
-                        st.markdown("**Problem:** _(Not available)_")
-                    
-                    if solution_text:
-                        st.markdown(f"**Solution:** {solution_text[:800]}")
-                    else:
-                        st.markdown("**Solution:** _(Not available)_")
-                    
-                    product_id = r.get('product_id', '').strip()
-                    doc_id = r.get('doc_id', '').strip()
-                    
-                    if product_id or doc_id:
-                        st.caption(f"**Product:** {product_id or 'N/A'} — **DocID:** {doc_id or 'N/A'}")
+                    st.markdown(body)
+                    if caption:
+                        st.caption(caption)
                     
                     # Warning if both are empty
                     if not problem_text and not solution_text:
@@ -172,31 +450,29 @@ if st.session_state.result:
 
     # ✅ Feedback Section
     st.markdown("## ✅ Feedback (Help Us Improve)")
-    fcol1, fcol2 = st.columns([1, 1])
 
     def record_feedback(status: str):
-        """Write feedback locally and upload to S3."""
-        os.makedirs("logs", exist_ok=True)
-        with open(feedback_file, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.utcnow().isoformat(),
-                st.session_state.query,
-                confidence,
-                mode,
-                status,
-                final_answer
-            ])
+        """Queue feedback for the background writer (local Parquet + S3 sync)."""
+        get_feedback_writer(feedback_dir).submit((
+            time.time(),
+            st.session_state.query,
+            confidence,
+            mode,
+            status,
+            final_answer
+        ))
         st.success(f"✅ Feedback recorded ({status}).")
-        upload_feedback_to_s3(feedback_file)
-
-    if fcol1.button("👍 Solution Worked"):
-        record_feedback("worked")
+        if not os.getenv("AWS_ACCESS_KEY_ID") or not os.getenv("AWS_SECRET_ACCESS_KEY"):
+            st.warning("⚠️ AWS credentials not configured. Feedback saved locally only.")
 
-    if fcol2.button("❗ Needs Manual Review"):
-        record_feedback("review")
+    # A form only reruns the script on submit, not on every choice change
+    feedback_labels = {"worked": "👍 Solution Worked", "review": "❗ Needs Manual Review"}
+    with st.form("feedback", clear_on_submit=True):
+        choice = st.radio("Result:", list(feedback_labels), format_func=feedback_labels.get, horizontal=True)
+        if st.form_submit_button("Submit Feedback"):
+            record_feedback(choice)
 
-    st.caption("Logs are saved locally in `logs/feedback.csv` and synced to S3.")
+    st.caption("Logs are saved locally under `logs/feedback/` (Parquet, partitioned by date) and synced to S3 in batches.")
 
 
 # ==============================
@@ -7,6 +7,30 @@ Usage: python verify_and_reindex.py
 
 import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+# Free-text fields may hold quoted line breaks; keep them inside their row across block boundaries
+CSV_PARSE_OPTIONS = pacsv.ParseOptions(newlines_in_values=True)
+
+def _peek_csv(filepath):
+    """Column names and first row of a CSV, parsing only its first block."""
+    reader = pacsv.open_csv(filepath, parse_options=CSV_PARSE_OPTIONS)
+    try:
+        batch = reader.read_next_batch()
+    except StopIteration:
+        return reader.schema.names, None
+    first_row = batch.slice(0, 1).to_pylist()[0] if batch.num_rows else None
+    return reader.schema.names, first_row
+
+def _count_rows_fast(filepath, column):
+    """Record count from a single-column, untyped pyarrow parse (quoted newlines handled)."""
+    return pacsv.read_csv(
+        filepath,
+        read_options=pacsv.ReadOptions(block_size=1 << 20),
+        parse_options=CSV_PARSE_OPTIONS,
+        convert_options=pacsv.ConvertOptions(include_columns=[column], column_types={column: pa.string()})
+    ).num_rows
 
 def verify_data_files():
     """Verify all data files exist and show their structure."""
@@ -24,22 +48,23 @@ def verify_data_files():
     for filepath in data_files:
         print(f"\n📄 {filepath}")
         if os.path.exists(filepath):
-            df = pd.read_csv(filepath)
-            print(f"   ✅ Found: {len(df)} records")
-            print(f"   📋 Columns: {', '.join(df.columns.tolist())}")
+            columns, first_row = _peek_csv(filepath)
+            n_records = _count_rows_fast(filepath, columns[0]) if first_row is not None else 0
+            print(f"   ✅ Found: {n_records} records")
+            print(f"   📋 Columns: {', '.join(columns)}")
             
             # Check for key columns
-            has_problem = any('problem' in c.lower() or 'description' in c.lower() for c in df.columns)
-            has_solution = any('solution' in c.lower() or 'steps' in c.lower() or 'detail' in c.lower() for c in df.columns)
+            cols_lower = pd.Index(columns, dtype=object).str.lower()
+            has_problem = bool(cols_lower.str.contains('problem|description').any())
+            has_solution = bool(cols_lower.str.contains('solution|steps|detail').any())
             
             print(f"   🔍 Has Problem field: {has_problem}")
             print(f"   🔧 Has Solution field: {has_solution}")
             
             # Show sample data
-            if not df.empty:
+            if first_row is not None:
                 print(f"   📊 Sample record:")
-                first_row = df.iloc[0]
-                for col in df.columns[:5]:  # Show first 5 columns
+                for col in columns[:5]:  # Show first 5 columns
                     value = str(first_row[col])[:50]
                     print(f"      {col}: {value}...")
         else:
@@ -56,11 +81,15 @@ def test_retriever_loading():
         from step2_retriever_qdrant import load_data
         df = load_data()
         
+        # one pass per column; every count below is derived from these masks
+        has_problem = df['problem_text'].fillna('').to_numpy(dtype=object) != ''
+        has_solution = df['solution_text'].fillna('').to_numpy(dtype=object) != ''
+        
         print(f"\n✅ Successfully loaded {len(df)} records")
         print(f"\n📊 Data Summary:")
-        print(f"   - Problem texts (non-empty): {(df['problem_text'].fillna('') != '').sum()}")
-        print(f"   - Solution texts (non-empty): {(df['solution_text'].fillna('') != '').sum()}")
-        print(f"   - Both problem & solution: {((df['problem_text'].fillna('') != '') & (df['solution_text'].fillna('') != '')).sum()}")
+        print(f"   - Problem texts (non-empty): {has_problem.sum()}")
+        print(f"   - Solution texts (non-empty): {has_solution.sum()}")
+        print(f"   - Both problem & solution: {(has_problem & has_solution).sum()}")
         
         print(f"\n📋 Source Distribution:")
         print(df['source'].value_counts().to_string())
@@ -75,9 +104,9 @@ def test_retriever_loading():
             print(f"   Product: {row['product_id']} | Doc: {row['doc_id']}")
         
         # Check for empty records
-        empty_records = df[(df['problem_text'].fillna('') == '') & (df['solution_text'].fillna('') == '')]
-        if len(empty_records) > 0:
-            print(f"\n⚠️ WARNING: Found {len(empty_records)} records with BOTH problem and solution empty!")
+        n_empty = (~(has_problem | has_solution)).sum()
+        if n_empty > 0:
+            print(f"\n⚠️ WARNING: Found {n_empty} records with BOTH problem and solution empty!")
         
         return True
         
@@ -116,7 +145,7 @@ def test_sample_query():
     print("="*70)
     
     try:
-        from step2_retriever_qdrant import retrieve_qdrant
+        from step2_retriever_qdrant import retrieve_qdrant_batch
         
         test_queries = [
             "BGP routing issues",
@@ -124,9 +153,11 @@ def test_sample_query():
             "The network isn't working"
         ]
         
-        for query in test_queries:
+        # one encoder call + one Qdrant round-trip for all queries
+        batch_results = retrieve_qdrant_batch(test_queries, limit=3)
+        
+        for query, results in zip(test_queries, batch_results):
             print(f"\n🔍 Query: '{query}'")
-            results = retrieve_qdrant(query, limit=3)
             
             for r in results[:3]:
                 print(f"\n   Rank {r['rank']} | Score: {r['score']:.3f} | Source: {r['source']}")